@@ -1,6 +1,30 @@
-from collections import deque
+from collections import deque, MutableMapping, MutableSet, Set
+import heapq
+import multiprocessing
+import pickle
 import util
-import functools
+
+try:
+    import numpy as np
+    from numba import njit
+except ImportError:
+    # The compiled AC3 kernel is optional, maintainArcConsistency falls back to pure Python
+    np = None
+    njit = None
+
+
+def _popcount(mask):
+    return bin(mask).count('1')
+
+
+def _bits(mask):
+    """
+    Yields the index of every set bit in mask, lowest first.
+    """
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
 
 """
     Base class for unary constraints
@@ -79,6 +103,30 @@ class BinaryConstraint:
             return self.var2
         return self.var1
 
+    def support_mask(self, csp, var, value_idx):
+        """
+        :param ConstraintSatisfactionProblem csp:
+        :param str var: the variable holding the value
+        :param int value_idx: index of the value in csp's value table
+        :return: bitmask of the other variable's values compatible with the value, out of the
+            values it can hold in csp
+        :rtype: int
+        """
+        is_satisfied = self.isSatisfied
+        index_value = csp._index_value
+        value = index_value[value_idx]
+        other_domain = csp._reachable_masks[csp._var_idx[self.otherVariable(var)]]
+        mask = 0
+        if var == self.var1:
+            for i in _bits(other_domain):
+                if is_satisfied(value, index_value[i]):
+                    mask |= 1 << i
+        else:
+            for i in _bits(other_domain):
+                if is_satisfied(index_value[i], value):
+                    mask |= 1 << i
+        return mask
+
 
 """
     Implementation of BinaryConstraint
@@ -92,10 +140,56 @@ class NotEqualConstraint(BinaryConstraint):
             return False
         return True
 
+    def support_mask(self, csp, var, value_idx):
+        if not _isNotEqual(self):
+            # A subclass changed isSatisfied, so the values have to be tested
+            return BinaryConstraint.support_mask(self, csp, var, value_idx)
+        return csp._all_mask ^ (1 << value_idx)
+
     def __repr__(self):
         return 'NotEqualConstraint (%s, %s)' % (str(self.var1), str(self.var2))
 
 
+"""
+    Implementation of BinaryConstraint
+    Satisfied if the value assigned to var1 is less than the value assigned to var2
+"""
+
+
+class LessThanConstraint(BinaryConstraint):
+    def isSatisfied(self, value1, value2):
+        return value1 < value2
+
+    def __repr__(self):
+        return 'LessThanConstraint (%s, %s)' % (str(self.var1), str(self.var2))
+
+
+def _isNotEqual(constraint):
+    """
+    Whether constraint is satisfied by exactly the pairs of different values, so its supports are
+    known without calling isSatisfied. Subclasses of NotEqualConstraint may override isSatisfied.
+    """
+    return constraint.__class__.isSatisfied.im_func is NotEqualConstraint.isSatisfied.im_func
+
+
+class _SupportTable(dict):
+    """
+    Support masks of a binary constraint from one of its variables, keyed by the index of that
+    variable's value. Rows are built on first lookup, so any value can be looked up while only
+    the values the variable actually takes cost isSatisfied calls.
+    """
+
+    def __init__(self, csp, constraint, var):
+        dict.__init__(self)
+        self._csp = csp
+        self._constraint = constraint
+        self._var = var
+
+    def __missing__(self, value_idx):
+        mask = self[value_idx] = self._constraint.support_mask(self._csp, self._var, value_idx)
+        return mask
+
+
 class ConstraintSatisfactionProblem:
     """
     Structure of a constraint satisfaction problem.
@@ -123,6 +217,44 @@ class ConstraintSatisfactionProblem:
             self.varDomains[variables[i]] = domains[i]
         self.binaryConstraints = binaryConstraints
         self.unaryConstraints = unaryConstraints
+        # The solver refers to variables by their position in variables, names are only kept for
+        # the dictionary views and solutions
+        self._variables = list(variables)
+        self._var_idx = {var: i for i, var in enumerate(variables)}
+        # Domains are stored as bitmasks over a shared table of every value in the problem
+        self._index_value = sorted(set().union(*domains))
+        self._value_index = {value: i for i, value in enumerate(self._index_value)}
+        self._all_mask = (1 << len(self._index_value)) - 1
+        self._domain_masks = [self.mask_of(domain) for domain in domains]
+        # Values each variable can hold: its initial domain, widened by any values written to its
+        # domain in an assignment. Support tables are built against these.
+        self._reachable_masks = list(self._domain_masks)
+        # Values allowed by all of each variable's unary constraints, bucketed by variable once
+        self._unary_masks = [self._all_mask] * len(variables)
+        for constraint in unaryConstraints:
+            i = self._var_idx.get(constraint.var)
+            if i is not None:
+                self._unary_masks[i] &= self.mask_of(
+                    value for value in self._index_value if constraint.isSatisfied(value))
+        # Adjacency index of the constraint graph, built once since constraints never change.
+        # Entries are (j, constraint, support, reverse_support) where support[value_idx] masks the
+        # values of j compatible with a value of i, and reverse_support is the same from j to i.
+        self._not_equal_support = [self._all_mask ^ (1 << k) for k in xrange(len(self._index_value))]
+        self._neighbors = [[] for _ in variables]
+        for constraint in binaryConstraints:
+            i, j = self._var_idx[constraint.var1], self._var_idx[constraint.var2]
+            forward = self._supportTable(constraint, constraint.var1)
+            backward = self._supportTable(constraint, constraint.var2)
+            self._neighbors[i].append((j, constraint, forward, backward))
+            self._neighbors[j].append((i, constraint, backward, forward))
+        self._degree = [len(neighbors) for neighbors in self._neighbors]
+        # Directed arcs (i, j, constraint, support), numbered so the arcs leaving a variable are contiguous
+        self._arcs = []
+        self._out_arcs = []
+        for i, neighbors in enumerate(self._neighbors):
+            first = len(self._arcs)
+            self._arcs.extend((i, j, constraint, support) for j, constraint, support, _ in neighbors)
+            self._out_arcs.append(xrange(first, len(self._arcs)))
 
     def __repr__(self):
         return '---Variable Domains\n%s---Binary Constraints\n%s---Unary Constraints\n%s' % ( \
@@ -131,20 +263,223 @@ class ConstraintSatisfactionProblem:
             ''.join([str(e) + '\n' for e in self.binaryConstraints]), \
             ''.join([str(e) + '\n' for e in self.binaryConstraints]))
 
+    def index_of(self, value):
+        """
+        Domains are bitmasks over the values of the initial domains, so no other value can be
+        stored in an assignment.
+
+        :param T value:
+        :return: the index of value in the value table
+        :rtype: int
+        :raises ValueError: if value is not in the initial domain of any variable
+        """
+        value_idx = self._value_index.get(value)
+        if value_idx is None:
+            raise ValueError('%r is not in the initial domain of any variable' % (value,))
+        return value_idx
+
+    def mask_of(self, values):
+        """
+        :param iterable values:
+        :rtype: int
+        :raises ValueError: if a value is not in the initial domain of any variable
+        """
+        mask = 0
+        for value in values:
+            mask |= 1 << self.index_of(value)
+        return mask
+
+    def values_of(self, mask):
+        """
+        :param int mask:
+        :rtype: set
+        """
+        return set(self._index_value[i] for i in _bits(mask))
+
+    def _supportTable(self, constraint, var):
+        """
+        :param BinaryConstraint constraint:
+        :param str var: the variable holding the value
+        :return: the constraint's support_mask for every value in the value table, by value index
+        :rtype: list[int] or _SupportTable
+        """
+        if _isNotEqual(constraint):
+            # Same for every not equal constraint, so one table is shared
+            return self._not_equal_support
+        return _SupportTable(self, constraint, var)
+
+    def _widen(self, i, mask):
+        """
+        Lets variable i hold the values in mask. Support rows built without them as candidates
+        for i are dropped, to be rebuilt on their next lookup.
+        """
+        if not mask & ~self._reachable_masks[i]:
+            return
+        self._reachable_masks[i] |= mask
+        for _, _, _, reverse_support in self._neighbors[i]:
+            if reverse_support is not self._not_equal_support:
+                reverse_support.clear()
+        if hasattr(self, '_kernel'):
+            del self._kernel
+
+    def _kernel_data(self):
+        """
+        Encodes the constraint graph as the CSR arrays taken by _ac3_kernel, using the same arc
+        ids as _arcs. Built once and cached, None if the kernel cannot handle this problem.
+
+        :rtype: tuple or None
+        """
+        if not hasattr(self, '_kernel'):
+            self._kernel = None
+            if _ac3_kernel is not None and len(self._index_value) <= 64:
+                ptr = [0]
+                for arcs in self._out_arcs:
+                    ptr.append(ptr[-1] + len(arcs))
+                idx, ctype, src, arc_table = [], [], [], []
+                tables, table_ids = [], {}
+                for i, j, constraint, support in self._arcs:
+                    idx.append(j)
+                    src.append(i)
+                    if support is self._not_equal_support:
+                        ctype.append(_KERNEL_NOT_EQUAL)
+                        arc_table.append(0)
+                    else:
+                        ctype.append(_KERNEL_TABLE)
+                        if id(support) not in table_ids:
+                            table_ids[id(support)] = len(tables)
+                            tables.append([support[k] for k in xrange(len(self._index_value))])
+                        arc_table.append(table_ids[id(support)])
+                tables = np.array(tables, dtype=np.uint64).reshape(len(tables), len(self._index_value))
+                self._kernel = (np.array(ptr, dtype=np.int32), np.array(idx, dtype=np.int32),
+                                np.array(ctype, dtype=np.int32), np.array(src, dtype=np.int32),
+                                np.array(arc_table, dtype=np.int32), tables)
+        return self._kernel
+
     def concerned_constraints(self, var):
-        return [constraint
-                for constraint in self.binaryConstraints
-                if constraint.affects(var)]
+        return [constraint for _, constraint, _, _ in self._neighbors[self._var_idx[var]]]
 
     def number_of_concerned_constraints(self, var):
-        return len(self.concerned_constraints(var))
+        return self._degree[self._var_idx[var]]
+
+
+class _Domain(MutableSet):
+    """
+    Set view of one variable's bitmask domain in an assignment.
+    Changes made on it, such as remove or add, are written straight back to the domain.
+    Adding a value outside of the problem's initial domains raises ValueError.
+    """
+
+    def __init__(self, assignment, i):
+        self._assignment = assignment
+        self._i = i
+
+    def __contains__(self, value):
+        value_idx = self._assignment.csp._value_index.get(value)
+        return value_idx is not None and bool(self._assignment._masks[self._i] >> value_idx & 1)
+
+    def __iter__(self):
+        return iter(self._assignment.csp.values_of(self._assignment._masks[self._i]))
+
+    def __len__(self):
+        return _popcount(self._assignment._masks[self._i])
+
+    def add(self, value):
+        csp = self._assignment.csp
+        mask = 1 << csp.index_of(value)
+        csp._widen(self._i, mask)
+        self._assignment._masks[self._i] |= mask
+
+    def discard(self, value):
+        value_idx = self._assignment.csp._value_index.get(value)
+        if value_idx is not None and self._assignment._masks[self._i] >> value_idx & 1:
+            self._assignment._masks[self._i] ^= 1 << value_idx
+
+    def __repr__(self):
+        return repr(self._assignment.csp.values_of(self._assignment._masks[self._i]))
+
+
+class _DomainView(MutableMapping):
+    """
+    Dictionary view of an assignment's bitmask domains.
+    Reading a variable gives a live set view of its domain and writing a set replaces the domain.
+    Only values from the problem's initial domains can be written, others raise ValueError.
+    """
+
+    def __init__(self, assignment):
+        self._assignment = assignment
+
+    def __getitem__(self, var):
+        return _Domain(self._assignment, self._assignment.csp._var_idx[var])
+
+    def __setitem__(self, var, values):
+        csp = self._assignment.csp
+        i = csp._var_idx[var]
+        mask = csp.mask_of(values)
+        csp._widen(i, mask)
+        self._assignment._masks[i] = mask
+
+    def __delitem__(self, var):
+        raise TypeError('Variables cannot be removed from an assignment')
+
+    def __iter__(self):
+        return iter(self._assignment.csp._variables)
+
+    def __len__(self):
+        return len(self._assignment.csp._variables)
+
+
+class _AssignedView(MutableMapping):
+    """
+    Dictionary view of an assignment's values by variable name.
+    Writes go through the assignment so its count of unassigned variables stays up to date.
+    Assigning a value outside of the problem's initial domains raises ValueError.
+    """
+
+    def __init__(self, assignment):
+        self._assignment = assignment
+
+    def __getitem__(self, var):
+        return self._assignment._values[self._assignment.csp._var_idx[var]]
+
+    def __setitem__(self, var, value):
+        if value is None:
+            self._assignment.unassign(var)
+        else:
+            self._assignment.assign(var, value)
+
+    def __delitem__(self, var):
+        raise TypeError('Variables cannot be removed from an assignment')
+
+    def __iter__(self):
+        return iter(self._assignment.csp._variables)
+
+    def __len__(self):
+        return len(self._assignment.csp._variables)
+
+
+class _DomainMasks(list):
+    """
+    List of domain bitmasks by variable index that tells its assignment about every change,
+    so the minimum remaining values heap sees domains shrink and grow back.
+    """
+
+    def __init__(self, assignment, masks):
+        list.__init__(self, masks)
+        self._assignment = assignment
+
+    def __setitem__(self, i, mask):
+        list.__setitem__(self, i, mask)
+        if self._assignment._mrv_heap is not None:
+            self._assignment._pushMrv(i)
 
 
 class Assignment:
     """
     Representation of a partial assignment.
-    Has the same varDomains dictionary stucture as ConstraintSatisfactionProblem.
+    Has the same varDomains dictionary stucture as ConstraintSatisfactionProblem, backed by
+    bitmasks over the csp's value table which the solver works on directly.
     Keeps a second dictionary from variables to assigned values, with None being no assignment.
+    Both dictionaries are views over lists indexed by the csp's variable numbering.
 
     Args:
         csp (ConstraintSatisfactionProblem): the problem definition for this assignment
@@ -155,10 +490,17 @@ class Assignment:
 
         :param ConstraintSatisfactionProblem csp:
         """
-        self.varDomains = {}
-        for var in csp.varDomains:
-            self.varDomains[var] = set(csp.varDomains[var])
-        self.assignedValues = {var: None for var in self.varDomains}
+        self.csp = csp
+        # Lazy heap of (domain size, -degree, stamp, variable), built on the first call to
+        # minimumRemainingValuesHeuristic. Only the entry with a variable's latest stamp is current.
+        self._mrv_heap = None
+        self._mrv_stamps = [0] * len(csp._variables)
+        self._mrv_stamp = 0
+        self._masks = _DomainMasks(self, csp._domain_masks)
+        self._values = [None] * len(csp._variables)
+        self._unassigned_count = len(self._values)
+        self.varDomains = _DomainView(self)
+        self.assignedValues = _AssignedView(self)
 
     """
     Determines whether this variable has been assigned.
@@ -175,7 +517,28 @@ class Assignment:
         :param str var:
         :rtype: bool
         """
-        return self.assignedValues[var] is not None
+        return self._values[self.csp._var_idx[var]] is not None
+
+    def assign(self, var, value):
+        """
+        :param str var:
+        :param T value:
+        :raises ValueError: if value is not in the initial domain of any variable
+        """
+        self.csp.index_of(value)
+        self._setValue(self.csp._var_idx[var], value)
+
+    def unassign(self, var):
+        """
+        :param str var:
+        """
+        self._setValue(self.csp._var_idx[var], None)
+
+    def _setValue(self, i, value):
+        self._unassigned_count += (value is None) - (self._values[i] is None)
+        self._values[i] = value
+        if value is None and self._mrv_heap is not None:
+            self._pushMrv(i)
 
     """
     Determines whether this problem has all variables assigned.
@@ -189,10 +552,7 @@ class Assignment:
         """
         :rtype: bool
         """
-        for var in self.assignedValues:
-            if not self.isAssigned(var):
-                return False
-        return True
+        return self._unassigned_count == 0
 
     """
     Gets the solution in the form of a dictionary.
@@ -209,7 +569,37 @@ class Assignment:
         """
         if not self.isComplete():
             return None
-        return self.assignedValues
+        return dict(zip(self.csp._variables, self._values))
+
+    def _pushMrv(self, i):
+        self._mrv_stamp += 1
+        self._mrv_stamps[i] = self._mrv_stamp
+        heapq.heappush(self._mrv_heap, (_popcount(self._masks[i]), -self.csp._degree[i],
+                                        self._mrv_stamp, i))
+        if len(self._mrv_heap) > 8 * len(self._masks) + 64:
+            # Too many stale entries, rebuild from the unassigned variables
+            self._buildMrv()
+
+    def _buildMrv(self):
+        self._mrv_heap = []
+        for i, value in enumerate(self._values):
+            if value is None:
+                self._pushMrv(i)
+
+    def _peekMrv(self):
+        """
+        :return: the unassigned variable with the fewest remaining values, most constrained on ties
+        :rtype: str
+        """
+        if self._mrv_heap is None:
+            self._buildMrv()
+        heap = self._mrv_heap
+        while heap:
+            _, _, stamp, i = heap[0]
+            if stamp == self._mrv_stamps[i] and self._values[i] is None:
+                return self.csp._variables[i]
+            heapq.heappop(heap)
+        return None
 
     def __repr__(self):
         return '---Variable Domains\n%s---Assigned Values\n%s' % (
@@ -219,6 +609,70 @@ class Assignment:
                      self.assignedValues]))
 
 
+class Inferences(Set):
+    """
+    The inferences made by one inference step, stored as a bitmask of removed values per variable.
+    Compares, iterates and prints like the set of (variable, value) tuples it stands for, while
+    undoing it restores each variable's domain with a single mask.
+
+    Args:
+        csp (ConstraintSatisfactionProblem): the problem the masks refer to
+        removed (dictionary<int, int>): removed values by variable index
+    """
+
+    def __init__(self, csp, removed=None):
+        self.csp = csp
+        self.removed = removed if removed is not None else {}
+
+    @classmethod
+    def _from_iterable(cls, iterable):
+        return set(iterable)
+
+    def __contains__(self, inference):
+        var, value = inference
+        i = self.csp._var_idx.get(var)
+        value_idx = self.csp._value_index.get(value)
+        return value_idx is not None and bool(self.removed.get(i, 0) >> value_idx & 1)
+
+    def __iter__(self):
+        for i, mask in self.removed.iteritems():
+            var = self.csp._variables[i]
+            for value in self.csp.values_of(mask):
+                yield (var, value)
+
+    def __len__(self):
+        return sum(_popcount(mask) for mask in self.removed.itervalues())
+
+    def __repr__(self):
+        return repr(set(self))
+
+    def add(self, i, mask):
+        if mask:
+            self.removed[i] = self.removed.get(i, 0) | mask
+
+    def update(self, other):
+        for i, mask in other.removed.iteritems():
+            self.add(i, mask)
+
+    def undo(self, assignment):
+        masks = assignment._masks
+        for i, mask in self.removed.iteritems():
+            masks[i] |= mask
+
+
+def _undoInferences(assignment, csp, inferences):
+    """
+    Puts the values removed by an inference method back into the assignment's domains.
+    Plain sets of (variable, value) tuples are accepted for inference methods that return them.
+    """
+    if isinstance(inferences, Inferences):
+        inferences.undo(assignment)
+        return
+    masks = assignment._masks
+    for var, val in inferences:
+        masks[csp._var_idx[var]] |= 1 << csp._value_index[val]
+
+
 ####################################################################################################
 
 
@@ -245,15 +699,34 @@ def consistent(assignment, csp, var, value):
     :param str var:
     :rtype: bool
     """
-    concerned_constraints = [constraint
-                             for constraint in csp.binaryConstraints
-                             if constraint.affects(var)
-                             and assignment.isAssigned(constraint.otherVariable(var))]
+    values = assignment._values
+    for j, constraint, _, _ in csp._neighbors[csp._var_idx[var]]:
+        other_value = values[j]
+        if other_value is None:
+            continue
+        # Constraints need not be symmetric, so the values go in the constraint's variable order
+        if constraint.var1 == var:
+            satisfied = constraint.isSatisfied(value, other_value)
+        else:
+            satisfied = constraint.isSatisfied(other_value, value)
+        if not satisfied:
+            return False
+    return True
 
-    satisfactions = [constraint.isSatisfied(value, assignment.assignedValues[constraint.otherVariable(var)])
-                     for constraint in concerned_constraints]
 
-    return all(satisfactions)
+def _consistentMask(assignment, csp, i):
+    """
+    Bitmask form of consistent for every value in the domain of variable i at once: the values
+    still supported by all of its assigned neighbors.
+    """
+    values = assignment._values
+    value_index = csp._value_index
+    mask = assignment._masks[i]
+    for j, _, _, reverse_support in csp._neighbors[i]:
+        other_value = values[j]
+        if other_value is not None:
+            mask &= reverse_support[value_index[other_value]]
+    return mask
 
 
 """
@@ -303,15 +776,13 @@ def recursiveBacktracking(assignment, csp, orderValuesMethod,
 
 
 def eliminateUnaryConstraints(assignment, csp):
-    domains = assignment.varDomains
-    for var in domains:
-        for constraint in (c for c in csp.unaryConstraints if c.affects(var)):
-            for value in (v for v in list(domains[var]) if
-                          not constraint.isSatisfied(v)):
-                domains[var].remove(value)
-                if len(domains[var]) == 0:
-                    # Failure due to invalid assignment
-                    return None
+    masks = assignment._masks
+    for i, allowed in enumerate(csp._unary_masks):
+        if masks[i] & ~allowed:
+            masks[i] &= allowed
+            if not masks[i]:
+                # Failure due to invalid assignment
+                return None
     return assignment
 
 
@@ -346,19 +817,7 @@ def minimumRemainingValuesHeuristic(assignment, csp):
     :param ConstraintSatisfactionProblem csp:
     :rtype: str
     """
-    domains = assignment.varDomains
-    unassigned_variables = [variable
-                            for variable in assignment.assignedValues
-                            if not assignment.isAssigned(variable)]
-    domain_lengths = [len(domains[variable])
-                      for variable in unassigned_variables]
-    min_length = min(domain_lengths)
-    min_domain_length_variables = [variable
-                                   for variable in unassigned_variables
-                                   if len(domains[variable]) == min_length]
-    variable_with_most_concerned_constraint = max(min_domain_length_variables,
-                                                  key=csp.number_of_concerned_constraints)
-    return variable_with_most_concerned_constraint
+    return assignment._peekMrv()
 
 
 """
@@ -393,24 +852,13 @@ def num_of_choices(assignment, csp, var, value=None):
         :param str var:
         :return: int
     """
-    domains = assignment.varDomains
-    concerned_constraints = csp.concerned_constraints(var)
-
-    return sum([len([choice
-                     for choice in domains[constraint.otherVariable(var)]
-                     if constraint.isSatisfied(choice, value)])
-                for constraint in concerned_constraints])
+    masks = assignment._masks
+    neighbors = csp._neighbors[csp._var_idx[var]]
+    if value is None:
+        return sum(_popcount(masks[j]) for j, _, _, _ in neighbors)
 
-
-
-def reduced_choices(assignment, csp, var, value):
-    """
-    :param Assignment assignment:
-    :param ConstraintSatisfactionProblem csp:
-    :param str var:
-    :return: int
-    """
-    return num_of_choices(assignment, csp, var) - num_of_choices(assignment, csp, var, value=value)
+    value_idx = csp._value_index[value]
+    return sum(_popcount(masks[j] & support[value_idx]) for j, _, support, _ in neighbors)
 
 
 
@@ -422,8 +870,27 @@ def leastConstrainingValuesHeuristic(assignment, csp, var):
     :param str var:
     :rtype: list
     """
-    values = list(assignment.varDomains[var])
-    values.sort(key=functools.partial(reduced_choices, assignment, csp, var))
+    masks = assignment._masks
+    value_index = csp._value_index
+    var_idx = csp._var_idx[var]
+    domain = masks[var_idx]
+
+    # Choices eliminated from the neighbors by each candidate value, scored for all values in one
+    # pass over the neighbors: a not equal neighbor only loses the candidate itself, so it counts
+    # once for each value the two domains share. Other constraints are scored from their support
+    # table while the neighbor's domain is at hand.
+    eliminated = [0] * len(csp._index_value)
+    for j, _, support, _ in csp._neighbors[var_idx]:
+        if support is csp._not_equal_support:
+            for i in _bits(masks[j] & domain):
+                eliminated[i] += 1
+        else:
+            other_domain = masks[j]
+            for i in _bits(domain):
+                eliminated[i] += _popcount(other_domain & ~support[i])
+
+    values = list(csp.values_of(domain))
+    values.sort(key=lambda value: eliminated[value_index[value]])
     return values
 
 
@@ -433,7 +900,7 @@ def leastConstrainingValuesHeuristic(assignment, csp, var):
 
 
 def noInferences(assignment, csp, var, value):
-    return set([])
+    return Inferences(csp)
 
 
 """
@@ -449,8 +916,8 @@ def noInferences(assignment, csp, var, value):
         var (string): the variable that has just been assigned a value
         value (string): the value that has just been assigned
     Returns:
-        set<tuple<variable, value>>
-        the inferences made in this call or None if inconsistent assignment
+        Inferences
+        the inferences made in this call, as a set<tuple<variable, value>>, or None if inconsistent assignment
 """
 
 
@@ -461,22 +928,20 @@ def forwardChecking(assignment, csp, var, value):
     :param ConstraintSatisfactionProblem csp:
     :param str var:
     :param value:
-    :rtype: set or None
-    """
-    inferences = set([])
-    domains = assignment.varDomains
-    concerned_constraints = csp.concerned_constraints(var)
-    inferences = set((constraint.otherVariable(var), choice)
-                     for constraint in concerned_constraints
-                     for choice in domains[constraint.otherVariable(var)]
-                     if not constraint.isSatisfied(value1=value,
-                                                   value2=choice))
-    for variable, choice in inferences:
-        domains[variable].remove(choice)
-        if not domains[variable]:
-            for v, c in inferences:
-                domains[v].add(c)
-            return None
+    :rtype: Inferences or None
+    """
+    masks = assignment._masks
+    value_idx = csp._value_index[value]
+    inferences = Inferences(csp)
+    for j, _, support, _ in csp._neighbors[csp._var_idx[var]]:
+        removed = masks[j] & ~support[value_idx]
+        if removed:
+            masks[j] ^= removed
+            inferences.add(j, removed)
+            if not masks[j]:
+                # Only the removals applied so far are in inferences
+                inferences.undo(assignment)
+                return None
     return inferences
 
 
@@ -519,26 +984,45 @@ def recursiveBacktrackingWithInferences(assignment, csp, orderValuesMethod,
     :rtype: Assignment
     """
 
-    if assignment.isComplete():
-        return assignment
-
-    next_variable = selectVariableMethod(assignment, csp)
-    consistent_values = [value
-                         for value in orderValuesMethod(assignment, csp, next_variable)
-                         if consistent(assignment, csp, next_variable, value)]
-    for value in consistent_values:
-        current_value = assignment.assignedValues[next_variable]
-        assignment.assignedValues[next_variable] = value
-        inferences = inferenceMethod(assignment, csp, next_variable, value)
-        if inferences is not None:
-            ret_solution = recursiveBacktracking(assignment, csp, orderValuesMethod, selectVariableMethod)
-            if ret_solution:
-                return ret_solution
-        assignment.assignedValues[next_variable] = current_value
+    masks = assignment._masks
+    value_index = csp._value_index
+    # One frame per assigned variable in place of a recursive call:
+    # [var_idx, var, remaining values, domain before the assignment, inferences of the current value]
+    stack = []
+    descend = True
+    while True:
+        if descend:
+            if assignment.isComplete():
+                return assignment
+            next_variable = selectVariableMethod(assignment, csp)
+            var_idx = csp._var_idx[next_variable]
+            consistent_mask = _consistentMask(assignment, csp, var_idx)
+            consistent_values = [value
+                                 for value in orderValuesMethod(assignment, csp, next_variable)
+                                 if consistent_mask >> value_index[value] & 1]
+            stack.append([var_idx, next_variable, iter(consistent_values), masks[var_idx], None])
+
+        frame = stack[-1]
+        var_idx, next_variable, values, domain, inferences = frame
         if inferences is not None:
-            for var, val in inferences:
-                assignment.varDomains[var].add(val)
-    return None
+            _undoInferences(assignment, csp, inferences)
+            frame[4] = None
+        descend = False
+        for value in values:
+            assignment.assign(next_variable, value)
+            masks[var_idx] = 1 << value_index[value]
+            inferences = inferenceMethod(assignment, csp, next_variable, value)
+            if inferences is not None:
+                frame[4] = inferences
+                descend = True
+                break
+            masks[var_idx] = domain
+        else:
+            assignment.unassign(next_variable)
+            masks[var_idx] = domain
+            stack.pop()
+            if not stack:
+                return None
 
 
 """
@@ -556,8 +1040,8 @@ def recursiveBacktrackingWithInferences(assignment, csp, orderValuesMethod,
         var2 (string): the variable that should have inconsistent values removed
         constraint (BinaryConstraint): the constraint connecting var1 and var2
     Returns:
-        set<tuple<variable, value>>
-        the inferences made in this call or None if inconsistent assignment
+        Inferences
+        the inferences made in this call, as a set<tuple<variable, value>>, or None if inconsistent assignment
 """
 
 
@@ -568,22 +1052,35 @@ def revise(assignment, csp, var1, var2, constraint):
     :param str var1:
     :param str var2:
     :param BinaryConstraint constraint:
-    :rtype: set[(str, T)]
+    :rtype: Inferences or None
     """
-    domains = assignment.varDomains
-    inferences = set([])
-    for val2 in domains[var2]:
-        is_consistent = any(constraint.isSatisfied(val1, val2) for val1 in domains[var1])
-        if not is_consistent:
-            inferences.add((var2, val2))
+    i = csp._var_idx[var1]
+    for _, neighbor_constraint, support, _ in csp._neighbors[i]:
+        if neighbor_constraint is constraint:
+            break
+    else:
+        support = csp._supportTable(constraint, var1)
+    return _revise(assignment, csp, i, csp._var_idx[var2], support)
 
-    if len(inferences) == len(domains[var2]):
-        return None
 
-    for var, val in inferences:
-        domains[var].remove(val)
+def _revise(assignment, csp, i, j, support_table):
+    """
+    revise with variables given by index and the constraint given by its support table from i to j.
+    """
+    masks = assignment._masks
+    domain2 = masks[j]
+    support = 0
+    for value_idx in _bits(masks[i]):
+        support |= support_table[value_idx]
+        if not domain2 & ~support:
+            break
+    removed = domain2 & ~support
+
+    if removed == domain2:
+        return None
 
-    return inferences
+    masks[j] = domain2 ^ removed
+    return Inferences(csp, {j: removed} if removed else {})
 
 
 """
@@ -599,8 +1096,8 @@ def revise(assignment, csp, var1, var2, constraint):
         var (string): the variable that has just been assigned a value
         value (string): the value that has just been assigned
     Returns:
-        set<<variable, value>>
-        the inferences made in this call or None if inconsistent assignment
+        Inferences
+        the inferences made in this call, as a set<tuple<variable, value>>, or None if inconsistent assignment
 """
 
 
@@ -611,31 +1108,139 @@ def maintainArcConsistency(assignment, csp, var=None, value=None, initialQueue=F
     :param ConstraintSatisfactionProblem csp:
     :param str var:
     :param T value:
-    :rtype: set[(str, T)]
+    :rtype: Inferences or None
     """
-    inferences = set([])
-    queue = util.Queue()
-    domains = assignment.varDomains
-    if initialQueue:
-        for constraint in csp.binaryConstraints:
-            queue.push((constraint.var1, constraint.var2, constraint))
-            queue.push((constraint.var2, constraint.var1, constraint))
-    else:
-        for constraint in csp.concerned_constraints(var):
-            queue.push((var, constraint.otherVariable(var), constraint))
-
-    while not queue.isEmpty():
-        var1, var2, constraint = queue.pop()
-        inference = revise(assignment, csp, var1, var2, constraint)
+    if csp._kernel_data() is not None:
+        return _kernelArcConsistency(assignment, csp, var, initialQueue)
+
+    inferences = Inferences(csp)
+    queue = deque()
+    arcs = csp._arcs
+    # Arcs already waiting in the queue are not pushed again
+    in_queue = bytearray(len(arcs))
+    for arc in (xrange(len(arcs)) if initialQueue else csp._out_arcs[csp._var_idx[var]]):
+        in_queue[arc] = 1
+        queue.append(arc)
+
+    while queue:
+        arc = queue.popleft()
+        in_queue[arc] = 0
+        i, j, _, support = arcs[arc]
+        inference = _revise(assignment, csp, i, j, support)
         if inference is None:
-            for _var, _val in inferences:
-                domains[_var].add(_val)
+            inferences.undo(assignment)
             return None
         if inference:
-            for _constraint in csp.concerned_constraints(var2):
-                queue.push((var2, _constraint.otherVariable(var2), _constraint))
-            inferences |= inference
+            for _arc in csp._out_arcs[j]:
+                if not in_queue[_arc]:
+                    in_queue[_arc] = 1
+                    queue.append(_arc)
+            inferences.update(inference)
+
+    return inferences
+
+
+"""
+    Compiled counterpart of maintainArcConsistency's propagation loop.
+    Domains are uint64 bitmasks indexed like the csp's kernel arrays, and the arc queue is a ring
+    buffer of arc ids with an in_queue flag per arc so an arc is never queued twice.
+    Each arc is either a not equal constraint, revised without any lookup, or a constraint revised
+    from its row of the support tables: the masks of var2's values compatible with each value.
 
+    Returns:
+        (boolean, array<uint64>)
+        whether the domains are still consistent, and the values removed from each variable
+"""
+
+
+# Arc types understood by _ac3_kernel
+_KERNEL_NOT_EQUAL = 0
+_KERNEL_TABLE = 1
+
+
+if njit is not None:
+    @njit(cache=True, nogil=True, error_model='numpy')
+    def _ac3_kernel(domains, neighbors_ptr, neighbors_idx, neighbors_ctype, arc_src, arc_table,
+                    tables, initial_arcs):
+        zero = np.uint64(0)
+        one = np.uint64(1)
+        num_values = tables.shape[1]
+        num_arcs = neighbors_idx.shape[0]
+        size = num_arcs + 1
+        removed = np.zeros(domains.shape[0], dtype=np.uint64)
+        queue = np.empty(size, dtype=np.int32)
+        in_queue = np.zeros(num_arcs, dtype=np.uint8)
+        head = 0
+        tail = 0
+        for arc in initial_arcs:
+            if not in_queue[arc]:
+                in_queue[arc] = 1
+                queue[tail] = arc
+                tail = (tail + 1) % size
+
+        while head != tail:
+            arc = queue[head]
+            head = (head + 1) % size
+            in_queue[arc] = 0
+            var2 = neighbors_idx[arc]
+            domain1 = domains[arc_src[arc]]
+            domain2 = domains[var2]
+
+            drop = zero
+            if neighbors_ctype[arc] == _KERNEL_NOT_EQUAL:
+                # A value of var2 loses its support only when var1 is down to that same value
+                if domain1 == zero:
+                    drop = domain2
+                elif domain1 & (domain1 - one) == zero:
+                    drop = domain2 & domain1
+            else:
+                support = zero
+                table = arc_table[arc]
+                for k in range(num_values):
+                    if (domain1 >> np.uint64(k)) & one:
+                        support |= tables[table, k]
+                drop = domain2 & ~support
+            if drop == zero:
+                continue
+            if drop == domain2:
+                return False, removed
+
+            domains[var2] = domain2 ^ drop
+            removed[var2] |= drop
+            for k in range(neighbors_ptr[var2], neighbors_ptr[var2 + 1]):
+                if not in_queue[k]:
+                    in_queue[k] = 1
+                    queue[tail] = k
+                    tail = (tail + 1) % size
+
+        return True, removed
+else:
+    _ac3_kernel = None
+
+
+def _kernelArcConsistency(assignment, csp, var, initialQueue):
+    """
+    Runs maintainArcConsistency through _ac3_kernel.
+    Domains are only copied back when propagation succeeds, so a failure needs no reversal.
+    """
+    ptr, idx, ctype, src, arc_table, tables = csp._kernel_data()
+    masks = assignment._masks
+    domains = np.array(masks, dtype=np.uint64)
+    if initialQueue:
+        initial_arcs = np.arange(len(idx), dtype=np.int32)
+    else:
+        i = csp._var_idx[var]
+        initial_arcs = np.arange(ptr[i], ptr[i + 1], dtype=np.int32)
+
+    ok, removed = _ac3_kernel(domains, ptr, idx, ctype, src, arc_table, tables, initial_arcs)
+    if not ok:
+        return None
+
+    inferences = Inferences(csp)
+    for i in np.flatnonzero(removed):
+        i = int(i)
+        masks[i] = int(domains[i])
+        inferences.add(i, int(removed[i]))
     return inferences
 
 
@@ -659,6 +1264,99 @@ def AC3(assignment, csp):
     return assignment
 
 
+# Smallest problem, in variables, worth splitting into components solved in worker processes
+_PARALLEL_MIN_VARIABLES = 200
+# Components smaller than this are batched together so each worker task carries enough work
+_PARALLEL_MIN_TASK_VARIABLES = 50
+
+
+def _connectedComponents(csp):
+    """
+    Groups the variables of a problem by connected component of its constraint graph.
+
+    :param ConstraintSatisfactionProblem csp:
+    :rtype: list[list[str]]
+    """
+    parent = range(len(csp._variables))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j, _, _ in csp._arcs:
+        parent[find(i)] = find(j)
+
+    components = {}
+    for i, var in enumerate(csp._variables):
+        components.setdefault(find(i), []).append(var)
+    return components.values()
+
+
+def _solveComponent(args):
+    return solve(*args)
+
+
+def _componentProblems(assignment, csp, components, orderValuesMethod, selectVariableMethod,
+                       inferenceMethod):
+    """
+    Splits a problem along its connected components into arguments for _solveComponent.
+    Small components are batched into one problem rather than sent as a task each.
+    Unary constraints are already applied to the assignment's domains and are left out.
+
+    :rtype: list[tuple]
+    """
+    tasks = []
+    batch = []
+    for variables in components:
+        if len(variables) >= _PARALLEL_MIN_TASK_VARIABLES:
+            tasks.append(variables)
+        else:
+            batch.extend(variables)
+            if len(batch) >= _PARALLEL_MIN_TASK_VARIABLES:
+                tasks.append(batch)
+                batch = []
+    if batch:
+        tasks.append(batch)
+
+    task_of = {}
+    for t, variables in enumerate(tasks):
+        for var in variables:
+            task_of[var] = t
+    constraints = [[] for _ in tasks]
+    for constraint in csp.binaryConstraints:
+        constraints[task_of[constraint.var1]].append(constraint)
+
+    problems = []
+    for variables, task_constraints in zip(tasks, constraints):
+        subproblem = ConstraintSatisfactionProblem(
+            variables, [set(assignment.varDomains[var]) for var in variables], task_constraints, [])
+        problems.append((subproblem, orderValuesMethod, selectVariableMethod, inferenceMethod, False))
+    return problems
+
+
+def _solveComponents(pool, problems):
+    """
+    Solves the problems made by _componentProblems in a pool of worker processes and merges the
+    solutions. The components share no constraints, so no coordination is needed between them.
+    The pool is terminated once done.
+
+    Returns:
+        dictionary<string, value>
+        A map from variables to their assigned values. None if some component has no solution.
+    """
+    try:
+        solution = {}
+        for component_solution in pool.imap_unordered(_solveComponent, problems):
+            if component_solution is None:
+                return None
+            solution.update(component_solution)
+        return solution
+    finally:
+        pool.terminate()
+
+
 """
     Solves a binary constraint satisfaction problem.
 
@@ -687,6 +1385,27 @@ def solve(csp, orderValuesMethod=leastConstrainingValuesHeuristic,
         assignment = AC3(assignment, csp)
         if assignment == None:
             return assignment
+
+    # Pool workers are daemons, which cannot start a pool of their own
+    if (len(csp._variables) >= _PARALLEL_MIN_VARIABLES
+            and not multiprocessing.current_process().daemon):
+        components = _connectedComponents(csp)
+        try:
+            # The methods have to be sent to the workers
+            pickle.dumps((orderValuesMethod, selectVariableMethod, inferenceMethod))
+        except (pickle.PicklingError, TypeError, AttributeError):
+            components = None
+        if components is not None and len(components) > 1:
+            problems = _componentProblems(assignment, csp, components, orderValuesMethod,
+                                          selectVariableMethod, inferenceMethod)
+            try:
+                pool = multiprocessing.Pool(min(multiprocessing.cpu_count(), len(problems)))
+            except (OSError, ImportError, NotImplementedError):
+                # Worker processes cannot be started here, the search below runs in this process
+                pool = None
+            if pool is not None:
+                return _solveComponents(pool, problems)
+
     if inferenceMethod is None or inferenceMethod == noInferences:
         assignment = recursiveBacktracking(assignment, csp, orderValuesMethod,
                                            selectVariableMethod)